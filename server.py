@@ -1,48 +1,255 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import requests
-from openai import OpenAI
+from quart import Quart, request, jsonify
+from quart_cors import cors
+from quart.json.provider import JSONProvider
+import orjson
+import httpx
+from openai import AsyncOpenAI
+from aiolimiter import AsyncLimiter
+import asyncio
+import atexit
 import os
 from dotenv import load_dotenv
-import re
-import base64
+import hashlib
+import ipaddress
+import logging
+import logging.handlers
+import queue
+import random
+import secrets
+import threading
+import time
 import urllib.parse
+from cachetools import TTLCache
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+# pybase64 is a SIMD-accelerated drop-in for the stdlib module
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# Redis is only needed to share screenshot jobs between workers (REDIS_URL)
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+# Selenium is only needed for the fallback screenshot, so it stays optional
+try:
+    from selenium import webdriver
+    from selenium.common.exceptions import InvalidSessionIdException, WebDriverException
+    from selenium.webdriver.chrome.options import Options
+except ImportError:
+    webdriver = None
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson, which serializes the large base64 screenshots much faster."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Serialize like jsonify(): one positional value, several as a list, or keyword args as a dict."""
+        if args and kwargs:
+            raise TypeError("response() takes either positional or keyword arguments, not both")
+        if kwargs:
+            obj = kwargs
+        elif len(args) == 1:
+            obj = args[0]
+        else:
+            obj = list(args) or None
+        # Hand orjson's bytes straight to the response instead of round-tripping through str
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
+app = Quart(__name__)
+app.json = OrjsonProvider(app)
+app = cors(app, allow_origin="*")
+
+# Log through a queue so request handlers only enqueue records; formatting and
+# writing happen on the listener thread
+log_queue = queue.SimpleQueue()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+logger.propagate = False
 
 # Load environment variables
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
 screenshotapi_key = os.getenv("SCREENSHOTAPI_KEY")
+redis_url = os.getenv("REDIS_URL")
 
 if not openai_api_key:
-    print("Error: OPENAI_API_KEY not found in .env file")
+    logger.error("OPENAI_API_KEY not found in .env file")
 
-try:
-    client = OpenAI(api_key=openai_api_key)
-except Exception as e:
-    print(f"Error initializing OpenAI client: {e}")
+# Created in before_serving so the clients are bound to the serving event loop
+client = None
+http_client = None
+redis_client = None
+
+# Upstream statuses worth retrying, with jittered exponential backoff between attempts
+RETRY_STATUSES = {429, 502, 503, 504}
+RETRY_TOTAL = 2
+RETRY_BACKOFF = 0.2
+
+# Caps on in-flight provider calls per worker, sized to the plans' rate limits.
+# Open AI is also held to a requests-per-minute budget.
+OPENAI_SEM = asyncio.Semaphore(50)
+OPENAI_RATE_LIMIT = AsyncLimiter(500, 60)
+SHOT_SEM = asyncio.Semaphore(20)
+
+@app.before_serving
+async def create_clients():
+    global client, http_client, redis_client
+    # One pooled client per worker: the TLS handshake is paid once and later
+    # calls reuse keep-alive connections. The transport retries failed connects.
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        http2=True,
+        retries=RETRY_TOTAL
+    )
+    http_client = httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(27.0, connect=3.05)
+    )
+    try:
+        # The SDK retries 429s itself with jittered exponential backoff
+        client = AsyncOpenAI(api_key=openai_api_key, max_retries=3)
+    except Exception as e:
+        logger.error("Error initializing OpenAI client: %s", e)
+    
+    if redis_url:
+        if aioredis is None:
+            logger.error("REDIS_URL is set but the redis package is not installed")
+        else:
+            redis_client = aioredis.from_url(redis_url)
+    
+    app.add_background_task(warm_connections)
+
+async def warm_connections():
+    """Open pooled connections to both providers so the first request skips the TLS handshake."""
+    try:
+        await http_client.head("https://api.screenshotapi.net/", timeout=5)
+    except httpx.HTTPError as e:
+        logger.warning("Could not pre-connect to ScreenshotAPI.net: %s", e)
+    if client is not None and openai_api_key:
+        try:
+            await client.models.list()
+        except Exception as e:
+            logger.warning("Could not pre-connect to Open AI: %s", e)
+
+@app.after_serving
+async def close_clients():
+    if http_client is not None:
+        await http_client.aclose()
+    if client is not None:
+        await client.close()
+    if redis_client is not None:
+        await redis_client.aclose()
+
+MAX_URL_LENGTH = 2048
+HOST_LABEL_CHARS = frozenset('abcdefghijklmnopqrstuvwxyz0123456789-')
 
 def is_valid_url(url):
     """Validate if the input is a proper URL with http:// or https://."""
-    regex = re.compile(
-        r'^https?://'  # Must start with http:// or https://
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain
-        r'localhost|'  # localhost
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # IP
-        r'(?::\d+)?'  # optional port
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-    return re.match(regex, url) is not None
-
-def capture_screenshot_with_screenshotapi(url):
+    # Parser-based rather than a regex: linear time and no backtracking on hostile input
+    if len(url) >= MAX_URL_LENGTH or any(c.isspace() for c in url):
+        return False
+    try:
+        parts = urllib.parse.urlsplit(url)
+        parts.port  # Raises ValueError for a malformed port
+    except ValueError:
+        return False
+    if parts.scheme.lower() not in ('http', 'https') or not parts.netloc:
+        return False
+    # user:pass@host hides the real host (http://bank.com@evil.com)
+    if parts.username or parts.password:
+        return False
+
+    host = parts.hostname or ''
+    if host == 'localhost':
+        return True
+    try:
+        ipaddress.IPv4Address(host)
+        return True
+    except ValueError:
+        pass
+
+    labels = host.rstrip('.').split('.')
+    # The top-level domain must be alphabetic, as with the old regex
+    tld = labels[-1]
+    if len(tld) < 2 or not tld.isascii() or not tld.isalpha():
+        return False
+    return len(labels) > 1 and all(
+        1 <= len(label) <= 63
+        and not label.startswith('-') and not label.endswith('-')
+        and set(label) <= HOST_LABEL_CHARS
+        for label in labels
+    )
+
+# Recently captured screenshots, keyed by a hash of the URL
+SCREENSHOT_CACHE = TTLCache(maxsize=1024, ttl=1800)
+screenshot_cache_lock = threading.Lock()
+
+# Recent Open AI verdicts, keyed by normalized URL
+VERDICT_CACHE = TTLCache(maxsize=4096, ttl=600)
+verdict_cache_lock = threading.Lock()
+
+async def get_with_retries(url, stream=False, **kwargs):
+    """GET through the shared client, retrying transient gateway errors.
+
+    With stream=True the body is left unread and the caller must close the response.
+    """
+    for attempt in range(RETRY_TOTAL + 1):
+        response = await http_client.send(http_client.build_request("GET", url, **kwargs), stream=stream)
+        if response.status_code not in RETRY_STATUSES or attempt == RETRY_TOTAL:
+            return response
+        await response.aclose()
+        await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+async def read_into_buffer(response):
+    """Read a streamed body into a single buffer sized from Content-Length.
+
+    Avoids building the full body as bytes and then copying it again when encoding.
+    """
+    length = int(response.headers.get('content-length') or 0)
+    buf = bytearray(length)
+    offset = 0
+    async for chunk in response.aiter_bytes():
+        end = offset + len(chunk)
+        if end <= length:
+            buf[offset:end] = chunk
+        else:
+            # Longer than advertised (or no length given): grow the buffer
+            buf[offset:] = chunk
+        offset = end
+    del buf[offset:]
+    return buf
+
+async def capture_screenshot_with_screenshotapi(url):
     """Capture a screenshot using ScreenshotAPI.net."""
     try:
-        print(f"Capturing screenshot with ScreenshotAPI.net for {url}")
+        logger.info("Capturing screenshot with ScreenshotAPI.net for %s", url)
         
         if not screenshotapi_key or screenshotapi_key == "your_screenshotapi_key_here":
             return {"screenshot": None, "error": "ScreenshotAPI.net key not configured"}
         
+        # Serve repeat checks of the same URL without another round-trip
+        cache_key = hashlib.blake2b(url.encode(), digest_size=16).digest()
+        with screenshot_cache_lock:
+            cached = SCREENSHOT_CACHE.get(cache_key)
+        if cached is not None:
+            logger.info("Using cached screenshot for %s", url)
+            return cached
+        
         # Updated ScreenshotAPI.net endpoint (as indicated in the error)
         api_url = "https://api.screenshotapi.net/screenshot"
         
@@ -53,106 +260,273 @@ def capture_screenshot_with_screenshotapi(url):
             'width': 1280,
             'height': 720,
             'full_page': 'false',
+            'file_type': 'webp',  # Several times smaller than PNG, less to download and encode
             'fresh': 'true'  # Don't use cached screenshot
         }
         
-        print(f"Making request to ScreenshotAPI.net for: {url}")
-        
-        # Make the API request
-        response = requests.get(api_url, params=params, timeout=30)
+        logger.info("Making request to ScreenshotAPI.net for: %s", url)
         
-        print(f"ScreenshotAPI.net response status: {response.status_code}")
-        
-        if response.status_code == 200:
-            # Check if the response is actually an image
-            content_type = response.headers.get('content-type', '')
-            if 'image' in content_type:
-                # Convert the image to base64
-                screenshot_data = base64.b64encode(response.content).decode('utf-8')
-                print("Screenshot captured successfully with ScreenshotAPI.net")
-                return {"screenshot": screenshot_data, "error": None}
-            else:
-                # Try to parse error message if not an image
-                error_text = response.text[:200]
-                error_msg = f"ScreenshotAPI.net returned non-image content: {error_text}"
-                print(error_msg)
-                return {"screenshot": None, "error": error_msg}
-        else:
-            error_msg = f"ScreenshotAPI.net error: {response.status_code} - {response.text[:200]}"
-            print(error_msg)
-            return {"screenshot": None, "error": error_msg}
+        async with SHOT_SEM:
+            # Make the API request, streaming the body so it is only copied once
+            response = await get_with_retries(api_url, params=params, stream=True)
+            try:
+                logger.info("ScreenshotAPI.net response status: %s", response.status_code)
             
-    except requests.RequestException as e:
+                if response.status_code == 200:
+                    # Check if the response is actually an image (image/webp, or whatever the API fell back to)
+                    content_type = response.headers.get('content-type', '')
+                    if 'image' in content_type:
+                        # Convert the image to base64
+                        body = await read_into_buffer(response)
+                        screenshot_data = base64.b64encode(memoryview(body)).decode('ascii')
+                        logger.info("Screenshot captured successfully with ScreenshotAPI.net")
+                        result = {"screenshot": screenshot_data, "screenshot_type": content_type.split(';')[0].strip(), "error": None}
+                        with screenshot_cache_lock:
+                            SCREENSHOT_CACHE[cache_key] = result
+                        return result
+                    else:
+                        # Try to parse error message if not an image
+                        await response.aread()
+                        error_text = response.text[:200]
+                        error_msg = f"ScreenshotAPI.net returned non-image content: {error_text}"
+                        logger.warning(error_msg)
+                        return {"screenshot": None, "error": error_msg}
+                else:
+                    await response.aread()
+                    error_msg = f"ScreenshotAPI.net error: {response.status_code} - {response.text[:200]}"
+                    logger.warning(error_msg)
+                    return {"screenshot": None, "error": error_msg}
+            finally:
+                await response.aclose()
+            
+    except httpx.HTTPError as e:
         error_msg = f"ScreenshotAPI.net request failed: {str(e)}"
-        print(error_msg)
+        logger.warning(error_msg)
         return {"screenshot": None, "error": error_msg}
     except Exception as e:
         error_msg = f"Unexpected error with ScreenshotAPI.net: {str(e)}"
-        print(error_msg)
+        logger.warning(error_msg)
         return {"screenshot": None, "error": error_msg}
 
+# Pool of warm headless Chrome instances for the fallback, so requests only pay
+# for page load and capture rather than a browser start-up
+DRIVER_POOL_SIZE = 4
+DRIVER_WAIT_TIMEOUT = 30
+DRIVER_POOL = queue.Queue(maxsize=DRIVER_POOL_SIZE)
+
+# Browsers currently alive, whether idle in the pool or checked out. Never exceeds
+# DRIVER_POOL_SIZE, so returning a driver to the pool can't overflow it.
+drivers_started = 0
+driver_count_lock = threading.Lock()
+
+# Built once and shared by every pooled browser
+if webdriver is not None:
+    CHROME_OPTIONS = Options()
+    for arg in (
+        "--headless=new",
+        "--no-sandbox",
+        "--disable-dev-shm-usage",
+        "--disable-gpu",
+        "--window-size=1280,720",
+        # Keep background tabs from being throttled when several run at once
+        "--disable-renderer-backgrounding",
+        "--disable-backgrounding-occluded-windows",
+    ):
+        CHROME_OPTIONS.add_argument(arg)
+
+def create_driver():
+    """Start a headless Chrome configured for screenshots."""
+    return webdriver.Chrome(options=CHROME_OPTIONS)
+
+def reserve_driver_slot():
+    """Claim room for one more browser; False if the pool is already at full size."""
+    global drivers_started
+    with driver_count_lock:
+        if drivers_started >= DRIVER_POOL_SIZE:
+            return False
+        drivers_started += 1
+        return True
+
+def release_driver_slot():
+    global drivers_started
+    with driver_count_lock:
+        drivers_started -= 1
+
+def start_pooled_driver():
+    """Start a browser in a reserved slot, giving the slot back if Chrome fails to start."""
+    try:
+        return create_driver()
+    except Exception:
+        release_driver_slot()
+        raise
+
+def fill_driver_pool():
+    """Start the pooled browsers; the fallback is optional, so failures are only reported.
+
+    Anything not started here is started on demand by acquire_driver().
+    """
+    if webdriver is None:
+        logger.warning("Selenium is not installed, fallback screenshots are disabled")
+        return
+    try:
+        while reserve_driver_slot():
+            DRIVER_POOL.put_nowait(start_pooled_driver())
+    except Exception as e:
+        logger.warning("Could not start fallback browsers: %s", e)
+
+def acquire_driver():
+    """Take an idle browser, start one if the pool isn't full size, or wait for one to free up."""
+    try:
+        return DRIVER_POOL.get_nowait()
+    except queue.Empty:
+        pass
+    # Covers a slow or failed start-up fill; if Chrome can't start this fails straight away
+    if reserve_driver_slot():
+        return start_pooled_driver()
+    return DRIVER_POOL.get(timeout=DRIVER_WAIT_TIMEOUT)
+
+def discard_driver(driver):
+    """Shut down a broken browser and free its pool slot."""
+    release_driver_slot()
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+def reset_driver(driver, url):
+    """Clear cookies and site storage browser-wide so nothing carries over to the next user."""
+    origins = set()
+    for visited in (url, driver.current_url):
+        parts = urllib.parse.urlsplit(visited)
+        if parts.scheme in ('http', 'https'):
+            origins.add(f"{parts.scheme}://{parts.netloc}")
+    
+    driver.get("about:blank")
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    for origin in origins:
+        driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+
+def return_driver(driver):
+    """Put a browser back in the pool, or shut it down if there is no room for it."""
+    try:
+        DRIVER_POOL.put_nowait(driver)
+    except queue.Full:
+        release_driver_slot()
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+@app.before_serving
+async def start_driver_pool():
+    app.add_background_task(fill_driver_pool)
+
+@app.after_serving
+async def stop_driver_pool():
+    while not DRIVER_POOL.empty():
+        driver = DRIVER_POOL.get_nowait()
+        release_driver_slot()
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
 # Alternative screenshot method using a different service
 def capture_screenshot_fallback(url):
     """Fallback screenshot method for when ScreenshotAPI fails."""
+    if webdriver is None:
+        return {"screenshot": None, "error": "Fallback screenshot also failed: Selenium is not installed"}
+    
     try:
         # Using a simple alternative - this may not work for all sites
         # but can serve as a backup
-        from selenium import webdriver
-        from selenium.webdriver.chrome.options import Options
-        import tempfile
+        logger.info("Trying fallback screenshot method for: %s", url)
         
-        print(f"Trying fallback screenshot method for: {url}")
-        
-        # Configure Chrome options
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--window-size=1280,720")
-        
-        driver = webdriver.Chrome(options=chrome_options)
-        driver.get(url)
-        
-        # Take screenshot
-        screenshot_data = driver.get_screenshot_as_base64()
-        driver.quit()
+        driver = acquire_driver()
+        try:
+            try:
+                driver.get(url)
+            except InvalidSessionIdException:
+                # The browser died since its last use; replace it in the same slot and retry once
+                logger.warning("Fallback browser session was lost, starting a new one")
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+                driver = None
+                driver = start_pooled_driver()
+                driver.get(url)
+            
+            # Capture through DevTools: faster than the WebDriver screenshot command
+            # and JPEG keeps the payload a fraction of the PNG size
+            capture = driver.execute_cdp_cmd("Page.captureScreenshot", {
+                "format": "jpeg",
+                "quality": 80,
+                "captureBeyondViewport": False
+            })
+            screenshot_data = capture["data"]
+        except WebDriverException:
+            # Chrome crashed or can't be reached; don't hand it to the next request
+            if driver is not None:
+                discard_driver(driver)
+                driver = None
+            raise
+        finally:
+            # driver is None if it was discarded or its replacement failed to start,
+            # both of which already freed the slot
+            if driver is not None:
+                try:
+                    reset_driver(driver, url)
+                except WebDriverException:
+                    discard_driver(driver)
+                else:
+                    return_driver(driver)
         
-        print("Fallback screenshot captured successfully")
-        return {"screenshot": screenshot_data, "error": None}
+        logger.info("Fallback screenshot captured successfully")
+        return {"screenshot": screenshot_data, "screenshot_type": "image/jpeg", "error": None}
         
+    except queue.Empty:
+        error_msg = "Fallback screenshot also failed: no browser available"
+        logger.warning(error_msg)
+        return {"screenshot": None, "error": error_msg}
     except Exception as e:
         error_msg = f"Fallback screenshot also failed: {str(e)}"
-        print(error_msg)
+        logger.warning(error_msg)
         return {"screenshot": None, "error": error_msg}
 
-def check_webpage_content(url):
-    """Check if the specific webpage is real using Open AI API."""
-    try:
-        # Check for full URL with scheme
-        if not url or not url.strip().startswith(('http://', 'https://')):
-            return {"result": "Please enter the full URL starting with http:// or https://", "screenshot": None, "error": None}
+def normalize_url(url):
+    """Normalize a URL for use as a cache key (lower-case scheme/host, no trailing slash)."""
+    parts = urllib.parse.urlsplit(url.strip())
+    path = parts.path.rstrip('/')
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ''))
 
-        # Validate URL format
-        if not is_valid_url(url):
-            return {"result": "Invalid URL format", "screenshot": None, "error": None}
+async def get_verdict(url, use_cache=True):
+    """Ask Open AI whether the webpage is real, reusing recent verdicts for the same URL."""
+    cache_key = normalize_url(url)
+    if use_cache:
+        with verdict_cache_lock:
+            cached = VERDICT_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
 
-        # Prepare prompt for Open AI
-        prompt = f"""
-        Analyze the following webpage URL to determine if the specific page is legitimate (real) and safe.
-        URL: {url}
-        
-        Consider factors such as:
-        - URL structure (e.g., misspellings, unusual subdomains or paths)
-        - Domain reputation (e.g., well-known sites like udemy.com are generally safe)
-        - Signs of phishing or scam pages
-
-        Respond with exactly one of these two options:
-        - "The webpage URL is real and seems safe" if the page is legitimate and safe.
-        - "The webpage URL is not real" if the page shows signs of being fake, suspicious, or is inaccessible.
-        """
-        
-        # Call Open AI API
-        response = client.chat.completions.create(
+    # Prepare prompt for Open AI
+    prompt = f"""
+    Analyze the following webpage URL to determine if the specific page is legitimate (real) and safe.
+    URL: {url}
+    
+    Consider factors such as:
+    - URL structure (e.g., misspellings, unusual subdomains or paths)
+    - Domain reputation (e.g., well-known sites like udemy.com are generally safe)
+    - Signs of phishing or scam pages
+
+    Respond with exactly one of these two options:
+    - "The webpage URL is real and seems safe" if the page is legitimate and safe.
+    - "The webpage URL is not real" if the page shows signs of being fake, suspicious, or is inaccessible.
+    """
+    
+    # Call Open AI API
+    async with OPENAI_SEM, OPENAI_RATE_LIMIT:
+        response = await client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "You are an expert in website security and legitimacy analysis. Only respond with one of the two specified options."},
@@ -160,26 +534,143 @@ def check_webpage_content(url):
             ],
             max_tokens=50
         )
-        
-        result = response.choices[0].message.content.strip()
+    
+    result = response.choices[0].message.content.strip()
+    with verdict_cache_lock:
+        VERDICT_CACHE[cache_key] = result
+    return result
+
+async def capture_screenshot(url, api_task):
+    """Finish a ScreenshotAPI.net capture, falling back to Selenium if it failed.
+
+    Only call this once the page is judged real: the fallback loads it in a local browser.
+    """
+    screenshot_result = await api_task
+    
+    # If ScreenshotAPI fails, try fallback
+    if not screenshot_result.get("screenshot"):
+        # Selenium is blocking, so keep it off the event loop
+        screenshot_result = await asyncio.to_thread(capture_screenshot_fallback, url)
+    return screenshot_result
+
+# Background screenshot jobs (?screenshot=async) and images handed out by URL
+# (?screenshot=url). Kept in Redis when REDIS_URL is set so any worker can answer
+# a poll; otherwise in this worker's memory.
+SCREENSHOT_STORE_TTL = 600
+SCREENSHOT_STORE = TTLCache(maxsize=2048, ttl=SCREENSHOT_STORE_TTL)
+
+# Keys the screenshot ids below. Set SCREENSHOT_ID_SECRET to the same value on every
+# worker so they hand out the same id for a URL.
+SCREENSHOT_ID_KEY = hashlib.blake2b((os.getenv("SCREENSHOT_ID_SECRET") or secrets.token_hex(32)).encode()).digest()
+
+def screenshot_entry_id(kind, url):
+    """Unguessable id for a URL's job or image entry.
+
+    Stable for a given URL so repeat checks return the same response body (and ETag).
+    """
+    return hashlib.blake2b(f"{kind}:{normalize_url(url)}".encode(), key=SCREENSHOT_ID_KEY, digest_size=16).hexdigest()
+
+async def save_screenshot_entry(key, entry):
+    if redis_client is not None:
+        await redis_client.set(f"website-checker:{key}", orjson.dumps(entry), ex=SCREENSHOT_STORE_TTL)
+    else:
+        SCREENSHOT_STORE[key] = entry
+
+async def load_screenshot_entry(key):
+    if redis_client is not None:
+        raw = await redis_client.get(f"website-checker:{key}")
+        return orjson.loads(raw) if raw is not None else None
+    return SCREENSHOT_STORE.get(key)
+
+# Longest a capture can plausibly run (ScreenshotAPI retries plus the fallback). A job
+# still pending after this was most likely lost with the worker that ran it.
+JOB_PENDING_TIMEOUT = 180
+
+def is_reusable_job(job):
+    """Whether a stored job can be handed out again: still running, or done with a screenshot."""
+    if job is None:
+        return False
+    if job["status"] == "pending":
+        return time.time() - job.get("started", 0) < JOB_PENDING_TIMEOUT
+    return bool(job.get("screenshot"))
+
+async def run_screenshot_job(job_id, url, api_task):
+    """Capture the screenshot for an async check and publish it for /screenshot/<job_id>."""
+    try:
+        screenshot_result = await capture_screenshot(url, api_task)
+    except Exception as e:
+        screenshot_result = {"screenshot": None, "error": f"Screenshot capture failed: {str(e)}"}
+    await save_screenshot_entry(f"job:{job_id}", {
+        "status": "done",
+        "screenshot": screenshot_result.get("screenshot"),
+        "screenshot_type": screenshot_result.get("screenshot_type"),
+        "error": screenshot_result.get("error")
+    })
+
+# Values of the ?screenshot= query parameter; anything else means "inline"
+SCREENSHOT_MODES = {'0': 'none', 'url': 'url', 'async': 'async'}
+
+async def check_webpage_content(url, use_cache=True, screenshot_mode="inline"):
+    """Check if the specific webpage is real using Open AI API.
+
+    screenshot_mode "inline" waits for the screenshot and returns it; "async" returns
+    as soon as the verdict is known, with a job id to poll at /screenshot/<job_id>;
+    "url" returns a link to the image instead of its base64; "none" skips the capture.
+    """
+    try:
+        # Check for full URL with scheme
+        if not url or not url.strip().startswith(('http://', 'https://')):
+            return {"result": "Please enter the full URL starting with http:// or https://", "screenshot": None, "error": None}
+
+        # Validate URL format
+        if not is_valid_url(url):
+            return {"result": "Invalid URL format", "screenshot": None, "error": None}
+
+        if screenshot_mode == "none":
+            result = await get_verdict(url, use_cache=use_cache)
+            return {"result": result, "screenshot": None, "error": None}
+
+        # The ScreenshotAPI capture doesn't depend on the verdict, so start both at once
+        # and drop the screenshot if the page turns out not to be real. The Selenium
+        # fallback only runs after the verdict, so suspect pages never reach our browsers.
+        api_task = asyncio.create_task(capture_screenshot_with_screenshotapi(url))
+        try:
+            result = await get_verdict(url, use_cache=use_cache)
+        except BaseException:
+            api_task.cancel()
+            raise
         screenshot_data = None
+        screenshot_type = None
         screenshot_error = None
         
         # Check if the result indicates a real and safe website
         if "real and seems safe" in result.lower():
-            screenshot_result = capture_screenshot_with_screenshotapi(url)
+            if screenshot_mode == "async":
+                job_id = screenshot_entry_id("job", url)
+                if use_cache and is_reusable_job(await load_screenshot_entry(f"job:{job_id}")):
+                    # This URL's screenshot is already captured or on its way
+                    api_task.cancel()
+                else:
+                    await save_screenshot_entry(f"job:{job_id}", {"status": "pending", "started": time.time()})
+                    app.add_background_task(run_screenshot_job, job_id, url, api_task)
+                return {"result": result, "screenshot": None, "screenshot_job": job_id, "error": None}
+            
+            screenshot_result = await capture_screenshot(url, api_task)
             screenshot_data = screenshot_result.get("screenshot")
+            screenshot_type = screenshot_result.get("screenshot_type")
             screenshot_error = screenshot_result.get("error")
             
-            # If ScreenshotAPI fails, try fallback
-            if not screenshot_data:
-                screenshot_result = capture_screenshot_fallback(url)
-                screenshot_data = screenshot_result.get("screenshot")
-                screenshot_error = screenshot_result.get("error")
+            if screenshot_mode == "url" and screenshot_data:
+                nonce = screenshot_entry_id("image", url)
+                await save_screenshot_entry(f"image:{nonce}", screenshot_result)
+                return {"result": result, "screenshot": None, "screenshot_url": f"/screenshot/{nonce}/image", "error": None}
+        else:
+            api_task.cancel()
         
         return {
             "result": result, 
             "screenshot": screenshot_data, 
+            "screenshot_type": screenshot_type,
             "error": screenshot_error
         }
     
@@ -190,25 +681,99 @@ def check_webpage_content(url):
             "error": None
         }
 
-@app.route('/check-website', methods=['POST'])
-def check_website():
-    data = request.get_json()
-    url = data.get('url')
-    if not url:
+def response_etag(result):
+    """ETag for a check result: the verdict plus the screenshot it carries or points to."""
+    etag = hashlib.blake2b(digest_size=8)
+    for field in ("result", "screenshot", "screenshot_type", "screenshot_job", "screenshot_url", "error"):
+        etag.update(orjson.dumps(result.get(field)))
+    return etag.hexdigest()
+
+# Checks currently running, keyed by normalized URL and options. Only touched from
+# the event loop, so there is no await between lookup and insert and no lock needed.
+INFLIGHT = {}
+
+async def check_webpage_content_shared(url, use_cache=True, screenshot_mode="inline"):
+    """Run check_webpage_content, letting concurrent requests for the same URL share one check."""
+    # Only coalesce URLs that pass validation: the key is normalized, so an invalid
+    # spelling must not join (or start) the check for a valid one
+    if not is_valid_url(url):
+        return await check_webpage_content(url, use_cache=use_cache, screenshot_mode=screenshot_mode)
+    key = (normalize_url(url), use_cache, screenshot_mode)
+    
+    task = INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(check_webpage_content(url, use_cache=use_cache, screenshot_mode=screenshot_mode))
+        INFLIGHT[key] = task
+        task.add_done_callback(lambda _: INFLIGHT.pop(key, None))
+    
+    # Shielded so a client disconnecting doesn't cancel the check for everyone else
+    return await asyncio.shield(task)
+
+@app.route('/check-website', methods=['GET', 'POST'])
+async def check_website():
+    # GET/HEAD (?url=...) lets browsers cache verdicts; POST with a JSON body still works
+    if request.method in ('GET', 'HEAD'):
+        url = request.args.get('url')
+    else:
+        data = await request.get_json(silent=True) or {}
+        url = data.get('url') if isinstance(data, dict) else None
+    if not url or not isinstance(url, str):
         return jsonify({
             'result': 'Please provide a URL', 
             'screenshot': None, 
             'error': None
         }), 400
     
-    result = check_webpage_content(url)
-    return jsonify(result)
+    # ?no_cache=1 forces a fresh verdict from Open AI
+    use_cache = request.args.get('no_cache') != '1'
+    # ?screenshot=async returns the verdict without waiting for the screenshot,
+    # ?screenshot=url links to the image and ?screenshot=0 skips it
+    screenshot_mode = SCREENSHOT_MODES.get(request.args.get('screenshot'), "inline")
+    result = await check_webpage_content_shared(url, use_cache=use_cache, screenshot_mode=screenshot_mode)
+    response = jsonify(result)
+    
+    # A forced refresh must not be served from the browser cache next time either
+    if not use_cache:
+        response.headers['Cache-Control'] = 'no-store'
+    # Let the browser revalidate repeat checks and skip re-downloading the screenshot
+    elif request.method in ('GET', 'HEAD') and not result["result"].startswith("Error analyzing webpage"):
+        etag = response_etag(result)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, max-age=600'
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+            response.set_data(b"")
+    return response
+
+@app.route('/screenshot/<job_id>', methods=['GET'])
+async def screenshot_job(job_id):
+    job = await load_screenshot_entry(f"job:{job_id}")
+    if job is None:
+        return jsonify({'status': 'unknown', 'screenshot': None, 'error': 'Unknown or expired screenshot job'}), 404
+    if job["status"] == "pending":
+        return jsonify({'status': 'pending', 'screenshot': None, 'error': None}), 202
+    return jsonify(job)
+
+@app.route('/screenshot/<nonce>/image', methods=['GET'])
+async def screenshot_image(nonce):
+    screenshot_result = await load_screenshot_entry(f"image:{nonce}")
+    if screenshot_result is None:
+        return jsonify({'error': 'Unknown or expired screenshot'}), 404
+    
+    response = app.response_class(
+        base64.b64decode(screenshot_result["screenshot"]),
+        mimetype=screenshot_result.get("screenshot_type") or "image/png"
+    )
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
 
 @app.route('/health', methods=['GET'])
-def health_check():
+async def health_check():
     return jsonify({'status': 'healthy'})
 
 if __name__ == '__main__':
     print("Server ready on port 5001")
     print(f"ScreenshotAPI.net key: {'Configured' if screenshotapi_key and screenshotapi_key != 'your_screenshotapi_key_here' else 'Not configured'}")
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    # Development server only; see the README for running under hypercorn/uvicorn.
+    # Debug mode adds a reloader, so it is opt-in.
+    app.run(debug=os.getenv("DEBUG") == "1", port=5001)
\ No newline at end of file